@@ -2,17 +2,24 @@
 # Main FastAPI application
 # This is the core backend for the AI-powered mental wellness chatbot
 
+import asyncio
 import logging
+import time
+import orjson
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, StringConstraints
+from typing import Annotated, List, Optional
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 
 # Import custom modules
-from nlp_pipeline import NLPPipeline
+from nlp_pipeline import get_nlp_pipeline
+from batch_scheduler import BatchScheduler
 from response_generator import ResponseGenerator
 from safety_handler import SafetyHandler
 
@@ -20,19 +27,91 @@ from safety_handler import SafetyHandler
 load_dotenv()
 
 # Configure logging
+# Messages use lazy %-args, so at WARNING+ (LOG_LEVEL in production) per-request
+# info/debug logs cost a level check instead of string formatting
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the NLP model once per worker process, after uvicorn forks workers,
+    and release shared resources on shutdown
+    """
+    try:
+        app.state.nlp = get_nlp_pipeline()
+        logger.info("NLP pipeline initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize NLP pipeline: {e}")
+        raise
+    
+    # Concurrent requests share batched forward passes through the sentiment model
+    app.state.sentiment_scheduler = BatchScheduler(app.state.nlp)
+    
+    yield
+    
+    # Stop the batching task and release pooled LLM provider connections
+    await app.state.sentiment_scheduler.aclose()
+    await response_generator.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Mental Wellness Chatbot API",
     description="AI-powered empathetic chatbot for mental wellness support",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson: C-accelerated JSON encoding
 )
 
+# Largest request body accepted; a full-length message plus conversation history fits easily
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", "65536"))
+
+class BodySizeLimitMiddleware:
+    """
+    Reject request bodies larger than max_bytes with 413, so oversized payloads
+    are never JSON-decoded. A declared Content-Length is checked before the body
+    is read; chunked bodies are counted as they arrive and cut off at the limit
+    """
+    
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length" and int(value) > self.max_bytes:
+                response = ORJSONResponse(
+                    status_code=413,
+                    content={"error": "Request body too large", "status_code": 413}
+                )
+                await response(scope, receive, send)
+                return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the route while it reads the body, so the
+                    # HTTPException handler turns it into the usual error response
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+# Added before CORS so 413 responses still carry CORS headers
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_REQUEST_BYTES)
+
 # Add CORS middleware for frontend communication
 app.add_middleware(
     CORSMiddleware,
@@ -42,14 +121,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize NLP components
-try:
-    nlp_pipeline = NLPPipeline()
-    logger.info("NLP pipeline initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize NLP pipeline: {e}")
-    raise
-
+# Initialize components (the NLP model is loaded in lifespan)
 response_generator = ResponseGenerator()
 safety_handler = SafetyHandler()
 
@@ -57,6 +129,8 @@ safety_handler = SafetyHandler()
 
 class Message(BaseModel):
     """Single message in conversation history"""
+    model_config = ConfigDict(extra="forbid")
+    
     role: str  # "user" or "assistant"
     content: str
     timestamp: Optional[str] = None
@@ -64,7 +138,10 @@ class Message(BaseModel):
 
 class ChatRequest(BaseModel):
     """Request body for chat endpoint"""
-    message: str
+    model_config = ConfigDict(extra="forbid")
+    
+    # Stripped, then length-checked while the body is validated
+    message: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=5000)]
     conversation_history: Optional[List[Message]] = []
 
 class SentimentAnalysis(BaseModel):
@@ -80,6 +157,8 @@ class RiskAssessment(BaseModel):
 
 class ChatResponse(BaseModel):
     """Response from chat endpoint"""
+    model_config = ConfigDict(extra="forbid")
+    
     user_message: str
     sentiment: SentimentAnalysis
     is_high_risk: bool
@@ -102,11 +181,10 @@ async def health_check():
     Health check endpoint to verify all services are running
     Returns status of NLP models and LLM provider
     """
-    return HealthResponse(
-        status="healthy",
-        timestamp=datetime.now().isoformat(),
-        nlp_model="distilbert-base-uncased-finetuned-sst-2-english",
-        llm_provider=os.getenv("LLM_PROVIDER", "huggingface-api")
+    return Response(
+        content=_get_health_body(),
+        media_type="application/json",
+        headers={"Cache-Control": f"public, max-age={HEALTH_REFRESH_SECONDS}"}
     )
 
 @app.get("/config")
@@ -115,13 +193,19 @@ async def get_config():
     Get current configuration (non-sensitive)
     Useful for frontend to understand system capabilities
     """
-    return {
-        "max_conversation_history": 20,
-        "sentiment_model": "distilbert-base-uncased-finetuned-sst-2-english",
-        "emotion_labels": ["NEGATIVE", "POSITIVE"],
-        "risk_detection_enabled": True,
-        "disclaimer": "This chatbot provides non-clinical mental wellness support. It is not a substitute for professional medical advice."
-    }
+    return Response(
+        content=CONFIG_BODY,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=60"}
+    )
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """
+    Sentiment cache statistics
+    Hit ratio helps tune SENTIMENT_CACHE_SIZE / SENTIMENT_CACHE_TTL
+    """
+    return app.state.nlp.cache_stats()
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
@@ -133,53 +217,42 @@ async def chat(request: ChatRequest):
     - Returns complete analysis and response
     """
     try:
-        user_message = request.message.strip()
-        
-        # Validate input
-        if not user_message:
-            raise HTTPException(status_code=400, detail="Message cannot be empty")
-        
-        if len(user_message) > 5000:
-            raise HTTPException(status_code=400, detail="Message too long (max 5000 characters)")
-        
-        logger.info(f"Processing message: {user_message[:100]}...")
+        user_message = request.message
+        logger.info("Processing message: %.100s...", user_message)
         
-        # 1. Sentiment Analysis
-        sentiment_result = nlp_pipeline.analyze_sentiment(user_message)
-        logger.info(f"Sentiment: {sentiment_result['label']} (score: {sentiment_result['score']:.3f})")
-        
-        # 2. Risk Detection
-        risk_result = safety_handler.assess_risk(user_message)
-        logger.info(f"Risk Level: {risk_result['risk_level']} - High Risk: {risk_result['is_high_risk']}")
+        # 1-2. Sentiment Analysis and Risk Detection (independent, run concurrently)
+        sentiment_result, risk_result = await _analyze_message(user_message)
+        logger.info("Sentiment: %s (score: %.3f)", sentiment_result['label'], sentiment_result['score'])
+        logger.info("Risk Level: %s - High Risk: %s", risk_result['risk_level'], risk_result['is_high_risk'])
         
         # 3. Handle high-risk cases
         if risk_result['is_high_risk']:
             bot_response = safety_handler.get_crisis_response()
-            logger.warning(f"High-risk message detected. Indicators: {risk_result['risk_indicators']}")
+            logger.warning("High-risk message detected. Indicators: %s", risk_result['risk_indicators'])
         else:
             # 4. Generate contextual response
             conversation_context = _format_conversation_context(
                 request.conversation_history,
                 user_message
             )
-            bot_response = response_generator.generate_response(
+            bot_response = await response_generator.generate_response(
                 user_message=user_message,
                 sentiment=sentiment_result['label'],
                 context=conversation_context
             )
         
-        # 5. Build response
-        return ChatResponse(
-            user_message=user_message,
-            sentiment=SentimentAnalysis(
-                label=sentiment_result['label'],
-                score=sentiment_result['score']
-            ),
-            is_high_risk=risk_result['is_high_risk'],
-            risk_level=risk_result['risk_level'],
-            bot_response=bot_response,
-            conversation_summary=_generate_summary(sentiment_result['label'])
-        )
+        # 5. Build response (plain dict: validated once against ChatResponse by FastAPI)
+        return {
+            "user_message": user_message,
+            "sentiment": {
+                "label": sentiment_result['label'],
+                "score": sentiment_result['score']
+            },
+            "is_high_risk": risk_result['is_high_risk'],
+            "risk_level": risk_result['risk_level'],
+            "bot_response": bot_response,
+            "conversation_summary": _generate_summary(sentiment_result['label'])
+        }
     
     except HTTPException:
         raise
@@ -190,6 +263,64 @@ async def chat(request: ChatRequest):
             detail="Internal server error processing your message"
         )
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming chat endpoint (server-sent events)
+    - Same analysis as /chat, sent first as a "meta" event
+    - Bot response follows as "token" events while the LLM generates it
+    - A final "done" event closes the stream
+    """
+    try:
+        user_message = request.message
+        logger.info("Processing streamed message: %.100s...", user_message)
+        
+        sentiment_result, risk_result = await _analyze_message(user_message)
+        
+        if risk_result['is_high_risk']:
+            logger.warning("High-risk message detected. Indicators: %s", risk_result['risk_indicators'])
+            chunks = _single_chunk(safety_handler.get_crisis_response())
+        else:
+            conversation_context = _format_conversation_context(
+                request.conversation_history,
+                user_message
+            )
+            chunks = response_generator.stream_response(
+                user_message=user_message,
+                sentiment=sentiment_result['label'],
+                context=conversation_context
+            )
+        
+        meta = {
+            "user_message": user_message,
+            "sentiment": sentiment_result,
+            "is_high_risk": risk_result['is_high_risk'],
+            "risk_level": risk_result['risk_level'],
+            "conversation_summary": _generate_summary(sentiment_result['label'])
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing streamed chat request: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error processing your message"
+        )
+    
+    async def event_stream():
+        yield _format_sse("meta", meta)
+        async for chunk in chunks:
+            yield _format_sse("token", {"text": chunk})
+        yield _format_sse("done", {})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop nginx / Render proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/analyze-sentiment")
 async def analyze_sentiment(request: ChatRequest):
     """
@@ -197,7 +328,7 @@ async def analyze_sentiment(request: ChatRequest):
     Useful for debugging or frontend preview
     """
     try:
-        sentiment = nlp_pipeline.analyze_sentiment(request.message)
+        sentiment = await app.state.sentiment_scheduler.submit(request.message)
         return sentiment
     except Exception as e:
         logger.error(f"Error in sentiment analysis: {e}")
@@ -218,20 +349,89 @@ async def assess_risk(request: ChatRequest):
 
 # ==================== Helper Functions ====================
 
+# Speaker labels for conversation context (anything that isn't "user" is the assistant)
+ROLE_LABELS = {"user": "User"}
+
+# Character budget for conversation history sent to the LLM
+MAX_CONTEXT_LENGTH = int(os.getenv("MAX_CONTEXT_LENGTH", "2000"))
+
 def _format_conversation_context(conversation_history: List[Message], current_message: str) -> str:
     """
     Format conversation history for context-aware response generation
-    Limits to last 10 messages to prevent token overflow
+    Limits to last 10 messages and MAX_CONTEXT_LENGTH characters to prevent token overflow
     """
     recent_history = conversation_history[-10:] if conversation_history else []
     
-    context = "Recent conversation:\n"
-    for msg in recent_history:
-        role = "User" if msg.role == "user" else "Assistant"
-        context += f"{role}: {msg.content}\n"
+    # Walk newest-first so the most recent turns are the ones that fit the budget
+    lines = []
+    budget = MAX_CONTEXT_LENGTH
+    for msg in reversed(recent_history):
+        line = f"{ROLE_LABELS.get(msg.role, 'Assistant')}: {msg.content}"
+        budget -= len(line) + 1
+        if budget < 0:
+            break
+        lines.append(line)
+    lines.reverse()
+    
+    return "\n".join(["Recent conversation:", *lines, f"Current user message: {current_message}"])
+
+# Static payloads are serialized once; the endpoints just hand back the bytes
+CONFIG_BODY = orjson.dumps({
+    "max_conversation_history": 20,
+    "sentiment_model": "distilbert-base-uncased-finetuned-sst-2-english",
+    "emotion_labels": ["NEGATIVE", "POSITIVE"],
+    "risk_detection_enabled": True,
+    "disclaimer": "This chatbot provides non-clinical mental wellness support. It is not a substitute for professional medical advice."
+})
+
+# How long a /health body (and its timestamp) is reused before being rebuilt
+HEALTH_REFRESH_SECONDS = 5
+
+_health_body = b""
+_health_expires = 0.0
+
+def _get_health_body() -> bytes:
+    """
+    Serialized /health payload, rebuilt at most every HEALTH_REFRESH_SECONDS
+    Load balancer probes hit this constantly; the timestamp doesn't need to be per-request
+    """
+    global _health_body, _health_expires
+    now = time.monotonic()
+    if now >= _health_expires:
+        _health_body = orjson.dumps(HealthResponse(
+            status="healthy",
+            timestamp=datetime.now().isoformat(),
+            nlp_model="distilbert-base-uncased-finetuned-sst-2-english",
+            llm_provider=os.getenv("LLM_PROVIDER", "huggingface-api")
+        ).model_dump())
+        _health_expires = now + HEALTH_REFRESH_SECONDS
+    return _health_body
+
+async def _analyze_message(user_message: str):
+    """
+    Sentiment and risk assessment for one message, run concurrently
+    The risk scan runs on the thread pool while the sentiment request waits in its batch,
+    so neither holds up the event loop or the other
     
-    context += f"Current user message: {current_message}"
-    return context
+    Returns:
+        (sentiment_result, risk_result)
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        app.state.sentiment_scheduler.submit(user_message),
+        loop.run_in_executor(None, safety_handler.assess_risk, user_message)
+    )
+
+def _format_sse(event: str, data: dict) -> str:
+    """
+    Format one server-sent event
+    Data is JSON-encoded so newlines inside tokens can't break the event framing
+    """
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+async def _single_chunk(text: str):
+    """Wrap a complete response as a one-chunk async stream"""
+    yield text
 
 def _generate_summary(sentiment: str) -> str:
     """
@@ -249,13 +449,28 @@ def _generate_summary(sentiment: str) -> str:
 async def http_exception_handler(request, exc):
     """Custom HTTP exception handler"""
     logger.error(f"HTTP Exception: {exc.detail}")
-    return {"error": exc.detail, "status_code": exc.status_code}
+    return ORJSONResponse(
+        status_code=exc.status_code,
+        content={"error": exc.detail, "status_code": exc.status_code}
+    )
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request, exc):
+    """Report request validation failures (empty / too long message) in the same shape"""
+    error = exc.errors()[0]
+    detail = f"{'.'.join(str(loc) for loc in error['loc'][1:])}: {error['msg']}"
+    logger.warning("Invalid request: %s", detail)
+    return ORJSONResponse(
+        status_code=422,
+        content={"error": detail, "status_code": 422}
+    )
 
 if __name__ == "__main__":
     import uvicorn
-    # Run with: python main.py
+    # Development only: python app.py (auto-reload, single worker)
+    # For production use multiple workers, see "Production Server" in README.md
     uvicorn.run(
-        "main:app",
+        "app:app",
         host="0.0.0.0",
         port=8000,
         reload=True,
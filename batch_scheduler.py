@@ -0,0 +1,126 @@
+# Batch Scheduler Module
+# Coalesces concurrent sentiment requests into batched model forward passes
+
+import asyncio
+import logging
+import os
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Largest batch sent through the model in one forward pass
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "16"))
+
+# How long the first request in a batch waits for others to join
+MAX_LATENCY_MS = float(os.getenv("MAX_LATENCY_MS", "10"))
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching for sentiment analysis
+    Requests arriving within MAX_LATENCY_MS of each other share one forward pass,
+    so throughput grows with concurrency instead of each request paying a full pass
+    """
+    
+    def __init__(self, nlp_pipeline, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_latency_ms: float = MAX_LATENCY_MS):
+        """
+        Args:
+            nlp_pipeline: Object exposing get_cached(text) and analyze_batch(texts)
+            max_batch_size: Flush as soon as this many requests are pending
+            max_latency_ms: Flush after this long even if the batch is not full
+        """
+        self.nlp_pipeline = nlp_pipeline
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_latency = max_latency_ms / 1000
+        self._queue = None
+        self._worker = None
+    
+    async def submit(self, text: str) -> Dict[str, any]:
+        """
+        Queue text for the next batch and wait for its sentiment result
+        
+        Args:
+            text: User message to analyze
+        
+        Returns:
+            Dict with 'label' and 'score', same as NLPPipeline.analyze_sentiment
+        """
+        # Cache hits skip the batching window entirely
+        cached = self.nlp_pipeline.get_cached(text)
+        if cached is not None:
+            return cached
+        
+        # Started lazily so the queue and task bind to the running event loop
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+    
+    async def aclose(self):
+        """Stop the background batching task (call on app shutdown)"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        # Requests still queued will never be batched; don't leave their callers waiting
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+        self._worker = None
+        self._queue = None
+    
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        """Wait for one request, then gather more until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_latency
+        
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+            except asyncio.CancelledError:
+                # Shut down by aclose() while the batch was still filling
+                for _, future in batch:
+                    future.cancel()
+                raise
+        
+        return batch
+    
+    async def _run(self):
+        """Background loop: collect a batch, run it off the event loop, resolve futures"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _ in batch]
+            
+            try:
+                # Model inference is CPU-bound; keep it off the event loop thread
+                results = await loop.run_in_executor(None, self.nlp_pipeline.analyze_batch, texts)
+            except asyncio.CancelledError:
+                # Shut down by aclose() mid-batch; these results will never arrive
+                for _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Batched sentiment analysis failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            logger.debug("Processed sentiment batch of %d", len(batch))
+            for (_, future), result in zip(batch, results):
+                # A caller may have gone away (client disconnect cancels its future)
+                if not future.done():
+                    future.set_result(result)
@@ -1,18 +1,24 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
-import torch
-from transformers import pipeline
+import ahocorasick
+import asyncio
+import orjson
 import os
 from dotenv import load_dotenv
 import logging
 
+from nlp_pipeline import get_nlp_pipeline
+from batch_scheduler import BatchScheduler
+
 load_dotenv()
 
 app = FastAPI(
     title="MindMate AI",
     version="1.0.0",
-    description="Mental wellness chatbot with sentiment analysis"
+    description="Mental wellness chatbot with sentiment analysis",
+    default_response_class=ORJSONResponse  # orjson: C-accelerated JSON encoding
 )
 
 # CORS for frontend
@@ -25,34 +31,65 @@ app.add_middleware(
 )
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Lazy-load model
 sentiment_model = None
+sentiment_scheduler = None
 crisis_keywords = [
     "suicide", "hurt myself", "kill myself", "die", "overdose",
     "self harm", "cut myself", "depressed", "hopeless", "worthless"
 ]
 
-def load_sentiment_model():
-    """Load DistilBERT only on first request."""
-    global sentiment_model
-    if sentiment_model is None:
+# Compile crisis keywords once into an Aho-Corasick automaton:
+# one linear pass over the text regardless of how many keywords there are
+crisis_automaton = ahocorasick.Automaton()
+for keyword in crisis_keywords:
+    crisis_automaton.add_word(keyword, keyword)
+crisis_automaton.make_automaton()
+
+# Static payloads serialized once at import; endpoints return the bytes as-is
+HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "nlp_model": "distilbert-base-uncased-finetuned-sst-2-english",
+    "llm_provider": "huggingface-api",
+    "memory_optimized": True
+})
+
+CRISIS_RESOURCES_BODY = orjson.dumps({
+    "crisis_detected": True,
+    "resources": {
+        "national_suicide_prevention": "1-800-273-8255",
+        "crisis_text_line": "Text HOME to 741741",
+        "international_association": "https://www.iasp.info/resources/Crisis_Centres/",
+        "mindmate_support": "Talk to a professional immediately"
+    }
+})
+
+async def load_sentiment_model():
+    """Load DistilBERT (ONNX Runtime, INT8 quantized) only on first request.
+    
+    Returns the batch scheduler that coalesces concurrent requests.
+    """
+    global sentiment_model, sentiment_scheduler
+    if sentiment_scheduler is None:
         logger.info("Loading DistilBERT model (first request)...")
         try:
-            sentiment_model = pipeline(
-                "sentiment-analysis",
-                model="distilbert-base-uncased-finetuned-sst-2-english",
-                device=-1,  # CPU only (Render has no GPU)
-                torch_dtype=torch.float16,  # Half precision: 50% less memory
-                model_kwargs={"low_cpu_mem_usage": True}  # Further optimization
-            )
-            logger.info("Model loaded successfully")
+            # CPU only (Render has no GPU); INT8 weights use ~4x less memory than FP32
+            # Shared per process, so importing app.py too won't load a second copy.
+            # Loading (and the one-time ONNX export) runs on a worker thread so the
+            # event loop keeps serving /health meanwhile; get_nlp_pipeline is locked,
+            # so concurrent first requests wait for the same load
+            model = await asyncio.get_running_loop().run_in_executor(None, get_nlp_pipeline)
         except Exception as e:
             logger.error(f"Model load failed: {e}")
             raise
-    return sentiment_model
+        if sentiment_scheduler is None:
+            sentiment_model = model
+            sentiment_scheduler = BatchScheduler(model)
+            logger.info("Model loaded successfully")
+    return sentiment_scheduler
 
 # Request models
 class TextRequest(BaseModel):
@@ -68,12 +105,11 @@ class SentimentResponse(BaseModel):
 @app.get("/health")
 async def health_check():
     """Lightweight health check for Render."""
-    return {
-        "status": "healthy",
-        "nlp_model": "distilbert-base-uncased-finetuned-sst-2-english",
-        "llm_provider": "huggingface-api",
-        "memory_optimized": True
-    }
+    return Response(
+        content=HEALTH_BODY,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=30"}
+    )
 
 # Root endpoint
 @app.get("/")
@@ -89,6 +125,14 @@ async def root():
         }
     }
 
+# Sentiment cache statistics
+@app.get("/cache-stats")
+async def cache_stats():
+    """Sentiment cache hit ratio, for tuning SENTIMENT_CACHE_SIZE."""
+    if sentiment_model is None:
+        return {"model_loaded": False}
+    return sentiment_model.cache_stats()
+
 # Sentiment analysis endpoint
 @app.post("/analyze", response_model=SentimentResponse)
 async def analyze_sentiment(request: TextRequest):
@@ -106,19 +150,20 @@ async def analyze_sentiment(request: TextRequest):
     if not request.text or len(request.text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
+    # One lowercase copy serves both the keyword scan and the (uncased) model.
+    # str.lower already has an ASCII fast path in CPython; round-tripping through
+    # bytes.lower() benchmarks slower and would drop non-ASCII characters
     text_lower = request.text.lower()
     
-    # Check for crisis indicators (instant, no model needed)
-    is_crisis = any(keyword in text_lower for keyword in crisis_keywords)
+    # Check for crisis indicators (instant, no model needed); stop at the first hit
+    is_crisis = next(crisis_automaton.iter(text_lower), None) is not None
     
     # Load model on first request
-    model = load_sentiment_model()
-    
-    # Truncate long texts to save memory
-    text_to_analyze = request.text[:512]
+    scheduler = await load_sentiment_model()
     
     try:
-        result = model(text_to_analyze)[0]
+        # The tokenizer truncates to the model's 512-token window
+        result = await scheduler.submit(text_lower)
         return SentimentResponse(
             text=request.text,
             sentiment=result["label"].upper(),
@@ -139,25 +184,24 @@ async def analyze_sentiment(request: TextRequest):
 @app.get("/crisis-resources")
 async def get_crisis_resources():
     """Return crisis support resources if needed."""
-    return {
-        "crisis_detected": True,
-        "resources": {
-            "national_suicide_prevention": "1-800-273-8255",
-            "crisis_text_line": "Text HOME to 741741",
-            "international_association": "https://www.iasp.info/resources/Crisis_Centres/",
-            "mindmate_support": "Talk to a professional immediately"
-        }
-    }
+    return Response(
+        content=CRISIS_RESOURCES_BODY,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=60"}
+    )
 
 # Error handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Handle all exceptions gracefully."""
     logger.error(f"Error: {exc}")
-    return {
-        "error": "Internal server error",
-        "status": 500
-    }
+    return ORJSONResponse(
+        status_code=500,
+        content={
+            "error": "Internal server error",
+            "status": 500
+        }
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -2,15 +2,123 @@
 # Handles sentiment analysis using pretrained transformer models
 
 import logging
-from transformers import pipeline
-from typing import Dict
+import os
+import tempfile
+import threading
+import numpy as np
+import onnx
+import onnxruntime as ort
+from cachetools import TTLCache
+from filelock import FileLock
+from tokenizers import Tokenizer
+from transformers import AutoConfig, AutoTokenizer
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+MODEL_ID = "distilbert-base-uncased-finetuned-sst-2-english"
+
+# Directory holding the exported, graph-optimized + INT8 quantized ONNX model
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_models")
+
+# Exact-match cache for repeated messages ("hi", "thanks", "I'm sad", ...)
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "4096"))
+SENTIMENT_CACHE_TTL = int(os.getenv("SENTIMENT_CACHE_TTL", "3600"))
+
+# ONNX Runtime threads per process (0 = all cores). Defaults to an even share of
+# the cores across WEB_CONCURRENCY workers so they don't oversubscribe the CPU
+_DEFAULT_NUM_THREADS = max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", "1"))))
+NLP_NUM_THREADS = int(os.getenv("NLP_NUM_THREADS", str(_DEFAULT_NUM_THREADS)))
+
+# Token-length buckets for batching: texts in different buckets run as separate
+# forward passes, so one long message doesn't pad a batch of short ones to its length
+LENGTH_BUCKETS = (32, 64, 128, 256, 512)
+
+def _export_quantized_model(model_id: str, save_dir: str) -> str:
+    """
+    Export the model to ONNX, fuse transformer subgraphs and apply dynamic INT8 quantization
+    Runs once; later startups reuse the quantized file on disk
+    Safe to call from several workers at once: one exports while the others wait on a lock
+    
+    Returns:
+        Path to the quantized ONNX model, with its weights in an external data file
+    """
+    shared_path = os.path.join(save_dir, "model_shared_weights.onnx")
+    data_name = os.path.basename(shared_path) + ".data"
+    # The .onnx file is moved into place last, so if it exists the export is complete
+    if os.path.exists(shared_path):
+        return shared_path
+    
+    os.makedirs(save_dir, exist_ok=True)
+    # Inter-process lock that works on both POSIX and Windows (start.bat)
+    with FileLock(os.path.join(save_dir, ".export.lock")):
+        # Another worker may have finished the export while this one waited
+        if os.path.exists(shared_path):
+            return shared_path
+        
+        # Build everything in a scratch directory on the same filesystem, then
+        # os.replace the finished files in, so no reader ever sees a partial file
+        with tempfile.TemporaryDirectory(dir=save_dir) as work_dir:
+            _quantize_model(model_id, work_dir)
+            
+            # Move the weights out of the protobuf into one flat side file. ONNX Runtime
+            # memory-maps external data, so read-only weights (the embedding tables) stay
+            # in the page cache shared by every worker instead of a private heap copy each
+            onnx.save_model(
+                onnx.load(os.path.join(work_dir, "model_optimized_quantized.onnx")),
+                os.path.join(work_dir, os.path.basename(shared_path)),
+                save_as_external_data=True,
+                all_tensors_to_one_file=True,
+                location=data_name,
+                size_threshold=1024
+            )
+            os.replace(os.path.join(work_dir, data_name), os.path.join(save_dir, data_name))
+            os.replace(os.path.join(work_dir, os.path.basename(shared_path)), shared_path)
+    
+    return shared_path
+
+def _quantize_model(model_id: str, save_dir: str):
+    """Export, graph-optimize and INT8-quantize the model into save_dir"""
+    # Imported here: optimum pulls in torch and datasets, which only the one-time
+    # export needs, not every worker that just loads the finished model
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTOptimizer, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+    
+    logger.info(f"Exporting {model_id} to ONNX with INT8 quantization...")
+    model = ORTModelForSequenceClassification.from_pretrained(model_id, export=True)
+    model.save_pretrained(save_dir)
+    
+    # Fuse attention, LayerNorm and GELU subgraphs into single ONNX Runtime kernels
+    # (ahead-of-time operator fusion, the ONNX counterpart of torch.compile / IPEX)
+    optimizer = ORTOptimizer.from_pretrained(model)
+    optimizer.optimize(
+        save_dir=save_dir,
+        optimization_config=OptimizationConfig(optimization_level=2)
+    )
+    
+    # Dynamic quantization: weights stored as int8, activations quantized at runtime
+    # avx512_vnni targets the int8 GEMM instructions on modern x86 CPUs
+    quantizer = ORTQuantizer.from_pretrained(save_dir, file_name="model_optimized.onnx")
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+
+def _normalize_text(text: str) -> str:
+    """
+    Cache key for a message
+    The model is uncased and ignores extra whitespace, so these variants score identically.
+    Not truncated: the tokenizer cuts at 512 tokens, and a character cut could split a word
+    """
+    return " ".join(text.lower().split())
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    """Numerically stable softmax over the last axis"""
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
 class NLPPipeline:
     """
     NLP Pipeline for sentiment and emotion analysis
-    Uses HuggingFace transformers with DistilBERT for efficiency
+    Uses DistilBERT exported to ONNX Runtime with INT8 quantization for efficiency
     """
     
     def __init__(self):
@@ -20,18 +128,83 @@ class NLPPipeline:
         Pre-trained on SST-2 (Stanford Sentiment Treebank)
         """
         try:
-            # Load sentiment analysis pipeline
             # This model classifies text as POSITIVE or NEGATIVE
-            self.sentiment_analyzer = pipeline(
-                "sentiment-analysis",
-                model="distilbert-base-uncased-finetuned-sst-2-english",
-                device=-1  # Use CPU (-1) or GPU (0) based on availability
+            model_path = _export_quantized_model(MODEL_ID, ONNX_MODEL_DIR)
+            
+            self.tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, use_fast=True)
+            
+            # Call the Rust tokenizer directly instead of going through the
+            # transformers wrapper (per-call kwarg handling, dict/tensor conversion).
+            # A private copy so the fixed truncation doesn't leak into self.tokenizer;
+            # padding is done per length bucket in _predict_batch
+            self._encoder = Tokenizer.from_str(self.tokenizer.backend_tokenizer.to_str())
+            self._encoder.no_padding()
+            self._encoder.enable_truncation(max_length=LENGTH_BUCKETS[-1])
+            self._pad_id = self.tokenizer.pad_token_id
+            self.id2label = AutoConfig.from_pretrained(MODEL_ID).id2label
+            session_options = ort.SessionOptions()
+            session_options.intra_op_num_threads = NLP_NUM_THREADS
+            self.session = ort.InferenceSession(
+                model_path,
+                sess_options=session_options,
+                providers=["CPUExecutionProvider"]
             )
+            
+            # TTLCache is not thread-safe; batches run on the executor thread pool
+            self._cache = TTLCache(maxsize=SENTIMENT_CACHE_SIZE, ttl=SENTIMENT_CACHE_TTL)
+            self._cache_lock = threading.Lock()
+            self.cache_hits = 0
+            self.cache_misses = 0
+            
+            # Warmup a few representative batch sizes / sequence lengths so kernels
+            # and the memory arena are primed before the first real request
+            for batch_size, words in ((1, 4), (1, 64), (4, 16)):
+                self._predict_batch(["hello " * words] * batch_size)
             logger.info("Sentiment analyzer loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load sentiment analyzer: {e}")
             raise
     
+    def _predict_batch(self, texts: List[str]) -> List[Dict[str, any]]:
+        """
+        Run a batch of texts through the ONNX session
+        Texts are grouped by token-length bucket and each group is one forward pass
+        
+        Returns:
+            List of dicts with 'label' and 'score' of the top class, in input order
+        """
+        encodings = self._encoder.encode_batch(texts)
+        
+        # Truncation guarantees every length fits the last bucket
+        buckets = {}
+        for i, enc in enumerate(encodings):
+            ceiling = next(size for size in LENGTH_BUCKETS if len(enc.ids) <= size)
+            buckets.setdefault(ceiling, []).append(i)
+        
+        results = [None] * len(texts)
+        for indices in buckets.values():
+            # Pad to the longest member rather than the bucket ceiling,
+            # so a lone short message doesn't pay for padding
+            width = max(len(encodings[i].ids) for i in indices)
+            input_ids = np.full((len(indices), width), self._pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(indices), width), dtype=np.int64)
+            for row, i in enumerate(indices):
+                ids = encodings[i].ids
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+            
+            logits = self.session.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": attention_mask
+            })[0]
+            
+            probs = _softmax(logits)
+            for row, i in enumerate(indices):
+                idx = int(probs[row].argmax())
+                results[i] = {"label": self.id2label[idx], "score": float(probs[row, idx])}
+        
+        return results
+    
     def analyze_sentiment(self, text: str) -> Dict[str, any]:
         """
         Analyze sentiment of input text
@@ -46,17 +219,20 @@ class NLPPipeline:
             if not text or len(text.strip()) == 0:
                 return {"label": "NEUTRAL", "score": 0.5}
             
-            # Truncate to 512 tokens (BERT limit)
-            truncated_text = text[:512]
+            # Normalize and serve repeats from cache
+            key = _normalize_text(text)
+            result = self._cache_lookup(key)
             
             # Run sentiment analysis
-            result = self.sentiment_analyzer(truncated_text)
+            if result is None:
+                result = self._predict_batch([key])[0]
+                self._cache_store(key, result)
             
             # Extract label and score
-            label = result[0]['label']  # POSITIVE or NEGATIVE
-            score = result[0]['score']  # Confidence score
+            label = result['label']  # POSITIVE or NEGATIVE
+            score = result['score']  # Confidence score
             
-            logger.debug(f"Sentiment analysis: {label} ({score:.3f})")
+            logger.debug("Sentiment analysis: %s (%.3f)", label, score)
             
             return {
                 "label": label,
@@ -68,6 +244,86 @@ class NLPPipeline:
             # Return neutral sentiment on error
             return {"label": "NEUTRAL", "score": 0.5}
     
+    def analyze_batch(self, texts: List[str]) -> List[Dict[str, any]]:
+        """
+        Analyze sentiment of several texts in a single forward pass
+        Used by the batch scheduler to serve concurrent requests together
+        
+        Args:
+            texts: User messages to analyze
+        
+        Returns:
+            List of dicts with 'label' and 'score', in the same order as texts
+        """
+        results = [{"label": "NEUTRAL", "score": 0.5} for _ in texts]
+        
+        # Empty messages stay NEUTRAL and never reach the model;
+        # cached and duplicate messages are resolved without a forward pass
+        pending = {}
+        for i, text in enumerate(texts):
+            if not text or not text.strip():
+                continue
+            key = _normalize_text(text)
+            cached = self._cache_lookup(key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.setdefault(key, []).append(i)
+        
+        if not pending:
+            return results
+        
+        try:
+            keys = list(pending)
+            batch_results = self._predict_batch(keys)
+            for key, result in zip(keys, batch_results):
+                self._cache_store(key, result)
+                for i in pending[key]:
+                    results[i] = dict(result)
+        except Exception as e:
+            logger.error(f"Error during batched sentiment analysis: {e}")
+        
+        return results
+    
+    def get_cached(self, text: str) -> Optional[Dict[str, any]]:
+        """
+        Return the cached sentiment for text, or None if it has to go through the model
+        Lets callers skip batching/queueing entirely on a cache hit
+        """
+        if not text or not text.strip():
+            return None
+        # Misses are counted when the text reaches analyze_batch, not here
+        return self._cache_lookup(_normalize_text(text), record_miss=False)
+    
+    def cache_stats(self) -> Dict[str, any]:
+        """Cache size and hit ratio, used to tune SENTIMENT_CACHE_SIZE"""
+        with self._cache_lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "size": len(self._cache),
+                "max_size": self._cache.maxsize,
+                "ttl_seconds": self._cache.ttl,
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_ratio": self.cache_hits / lookups if lookups else 0.0
+            }
+    
+    def _cache_lookup(self, key: str, record_miss: bool = True) -> Optional[Dict[str, any]]:
+        """Thread-safe cache read; returns a copy so callers can't mutate cached entries"""
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is None:
+                if record_miss:
+                    self.cache_misses += 1
+                return None
+            self.cache_hits += 1
+        return dict(result)
+    
+    def _cache_store(self, key: str, result: Dict[str, any]):
+        """Thread-safe cache write"""
+        with self._cache_lock:
+            self._cache[key] = result
+    
     def get_emotion_insights(self, sentiment: str, score: float) -> str:
         """
         Convert sentiment label to human-readable emotion insights
@@ -90,3 +346,17 @@ class NLPPipeline:
                 return "User expressing positive emotions (optimism, contentment)"
             else:
                 return "User expressing mixed or neutral emotions"
+
+_shared_pipeline = None
+_shared_pipeline_lock = threading.Lock()
+
+def get_nlp_pipeline() -> NLPPipeline:
+    """
+    Process-wide NLPPipeline instance
+    Every entrypoint goes through here so the model is never loaded twice in one process
+    """
+    global _shared_pipeline
+    with _shared_pipeline_lock:
+        if _shared_pipeline is None:
+            _shared_pipeline = NLPPipeline()
+    return _shared_pipeline
@@ -1,13 +1,67 @@
 # Response Generator Module
 # Generates empathetic, emotionally-aware responses using LLM
 
+import asyncio
+import json
 import logging
-import requests
+import httpx
 import os
-from typing import Optional
+import random
+from typing import AsyncIterator, Optional
 
 logger = logging.getLogger(__name__)
 
+# Max concurrent requests to the LLM provider (like Ollama's OLLAMA_NUM_PARALLEL)
+LLM_MAX_PARALLEL = int(os.getenv("LLM_MAX_PARALLEL", "8"))
+
+# Template responses used when no LLM is available, keyed by sentiment
+# Built once at import; tuples are immutable so every call can share them
+FALLBACK_RESPONSES = {
+    "NEGATIVE": (
+        "I hear that you're going through a difficult time. It's okay to feel this way, and I'm here to listen. What's been the most challenging part for you?",
+        "Thank you for sharing that with me. Those feelings are valid, and many people experience what you're going through. Have you tried any coping strategies that have helped before?",
+        "I can sense you're struggling right now. That takes courage to express. Remember that difficult feelings are temporary, even when they feel overwhelming.",
+        "It sounds like you're dealing with a lot. While I can't provide medical advice, I encourage you to consider talking with a counselor or therapist who can offer professional support.",
+        "I appreciate you opening up about this. Sometimes just acknowledging what we're feeling is an important first step. What would help you feel a little better right now?",
+    ),
+    "POSITIVE": (
+        "That sounds wonderful! It's great to hear positive energy from you. What's been contributing to this good feeling?",
+        "I'm glad to hear that! Celebrating these moments is important. How are you planning to maintain this positive momentum?",
+        "That's fantastic! Keep nurturing what's bringing you joy. What's one thing you appreciate about yourself right now?",
+        "Your positive outlook is inspiring! Keep channeling that energy into things that matter to you.",
+        "That's excellent! It sounds like things are moving in a good direction for you. What's helping you feel this way?",
+    )
+}
+
+# System prompt guiding LLM behavior; only the last line depends on sentiment,
+# so both variants are assembled once here instead of on every request
+BASE_SYSTEM_PROMPT = """You are a compassionate, empathetic mental wellness support chatbot.
+Your role is to provide emotional support and encourage healthy coping strategies.
+
+IMPORTANT GUIDELINES:
+1. Always be warm, non-judgmental, and supportive
+2. Validate the person's feelings and experiences
+3. Ask thoughtful follow-up questions to show you understand
+4. Suggest healthy coping strategies (journaling, exercise, breathing exercises, etc.)
+5. Encourage professional help when appropriate
+6. NEVER provide medical advice, diagnosis, or prescriptions
+7. NEVER pretend to be a licensed therapist or psychiatrist
+8. Keep responses concise and natural (2-4 sentences)
+9. Use simple, clear language
+10. If user is in crisis, immediately redirect to professional help
+
+Remember: You are NOT a mental health professional. You provide general wellness support only."""
+
+SYSTEM_PROMPTS = {
+    "NEGATIVE": BASE_SYSTEM_PROMPT + "\n\nThe user is expressing negative emotions. Show extra empathy and validation.",
+    "POSITIVE": BASE_SYSTEM_PROMPT + "\n\nThe user seems to be in a better emotional state. Encourage positive momentum."
+}
+
+# Llama-2-chat framing up to the user turn, one per system prompt
+LLAMA2_PROMPT_PREFIXES = {
+    prompt: f"[INST] <<SYS>>\n{prompt}\n<</SYS>>\n\n" for prompt in SYSTEM_PROMPTS.values()
+}
+
 class ResponseGenerator:
     """
     Generates emotionally aware responses using HuggingFace Inference API or local LLM
@@ -16,6 +70,7 @@ class ResponseGenerator:
     - LLM_PROVIDER: "huggingface-api" or "ollama"
     - HF_API_KEY: HuggingFace API token (for HF provider)
     - OLLAMA_URL: Ollama server URL (for local provider, default: http://localhost:11434)
+    - LLM_MAX_PARALLEL: Max concurrent LLM requests (default: 8)
     """
     
     def __init__(self):
@@ -37,8 +92,20 @@ class ResponseGenerator:
         else:
             logger.warning(f"Unknown provider: {self.provider}. Using fallback mode.")
             self.provider = "fallback"
+        
+        # Shared async client: keep-alive connections are reused across requests
+        # instead of a new TCP/TLS handshake per LLM call
+        self.client = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        )
+        self._llm_slots = asyncio.Semaphore(LLM_MAX_PARALLEL)
+    
+    async def aclose(self):
+        """Close the shared HTTP client (call on app shutdown)"""
+        await self.client.aclose()
     
-    def generate_response(self, user_message: str, sentiment: str, context: str) -> str:
+    async def generate_response(self, user_message: str, sentiment: str, context: str) -> str:
         """
         Generate empathetic response based on user message and sentiment
         
@@ -59,10 +126,10 @@ class ResponseGenerator:
             
             # Generate response based on provider
             if self.provider == "huggingface-api" and self.api_key:
-                response = self._generate_with_huggingface(system_prompt, user_prompt)
+                response = await self._generate_with_huggingface(system_prompt, user_prompt)
             
             elif self.provider == "ollama":
-                response = self._generate_with_ollama(system_prompt, user_prompt)
+                response = await self._generate_with_ollama(system_prompt, user_prompt)
             
             else:
                 # Fallback mode when no LLM is available
@@ -74,6 +141,53 @@ class ResponseGenerator:
             logger.error(f"Error generating response: {e}")
             return self._generate_fallback_response(user_message, sentiment)
     
+    async def stream_response(self, user_message: str, sentiment: str, context: str) -> AsyncIterator[str]:
+        """
+        Stream an empathetic response token by token
+        Same prompts and providers as generate_response, but text is yielded
+        as soon as the LLM produces it instead of after the full generation
+        
+        Args:
+            user_message: Original user message
+            sentiment: Detected sentiment (POSITIVE/NEGATIVE)
+            context: Conversation context for continuity
+        
+        Yields:
+            Chunks of the generated response
+        """
+        system_prompt = self._build_system_prompt(sentiment)
+        user_prompt = self._build_user_prompt(user_message, context)
+        
+        if self.provider == "huggingface-api" and self.api_key:
+            chunks = self._stream_with_huggingface(system_prompt, user_prompt)
+        elif self.provider == "ollama":
+            chunks = self._stream_with_ollama(system_prompt, user_prompt)
+        else:
+            chunks = None
+        
+        emitted = 0
+        if chunks is not None:
+            try:
+                async for chunk in chunks:
+                    if emitted == 0:
+                        chunk = chunk.lstrip()
+                    # Same 300 character limit as non-streamed responses
+                    chunk = chunk[:300 - emitted]
+                    if chunk:
+                        emitted += len(chunk)
+                        yield chunk
+                    if emitted >= 300:
+                        break
+            except Exception as e:
+                logger.error(f"Error streaming response: {e}")
+            finally:
+                # Release the upstream connection even if we stopped early
+                await chunks.aclose()
+        
+        # Nothing streamed (no LLM, or it failed before the first token)
+        if emitted == 0:
+            yield self._generate_fallback_response(user_message, sentiment)
+    
     def _build_system_prompt(self, sentiment: str) -> str:
         """
         Build system prompt that guides LLM behavior
@@ -84,30 +198,7 @@ class ResponseGenerator:
         Returns:
             System prompt with safety and empathy guidelines
         """
-        base_prompt = """You are a compassionate, empathetic mental wellness support chatbot.
-Your role is to provide emotional support and encourage healthy coping strategies.
-
-IMPORTANT GUIDELINES:
-1. Always be warm, non-judgmental, and supportive
-2. Validate the person's feelings and experiences
-3. Ask thoughtful follow-up questions to show you understand
-4. Suggest healthy coping strategies (journaling, exercise, breathing exercises, etc.)
-5. Encourage professional help when appropriate
-6. NEVER provide medical advice, diagnosis, or prescriptions
-7. NEVER pretend to be a licensed therapist or psychiatrist
-8. Keep responses concise and natural (2-4 sentences)
-9. Use simple, clear language
-10. If user is in crisis, immediately redirect to professional help
-
-Remember: You are NOT a mental health professional. You provide general wellness support only."""
-        
-        # Adjust tone based on sentiment
-        if sentiment == "NEGATIVE":
-            base_prompt += "\n\nThe user is expressing negative emotions. Show extra empathy and validation."
-        else:
-            base_prompt += "\n\nThe user seems to be in a better emotional state. Encourage positive momentum."
-        
-        return base_prompt
+        return SYSTEM_PROMPTS.get(sentiment, SYSTEM_PROMPTS["POSITIVE"])
     
     def _build_user_prompt(self, user_message: str, context: str) -> str:
         """
@@ -125,7 +216,7 @@ Remember: You are NOT a mental health professional. You provide general wellness
 Please respond warmly and supportively to the user's message. Remember to stay within your role as a wellness chatbot."""
         return prompt
     
-    def _generate_with_huggingface(self, system_prompt: str, user_prompt: str) -> str:
+    async def _generate_with_huggingface(self, system_prompt: str, user_prompt: str) -> str:
         """
         Generate response using HuggingFace Inference API
         
@@ -135,12 +226,6 @@ Please respond warmly and supportively to the user's message. Remember to stay w
         try:
             headers = {"Authorization": f"Bearer {self.api_key}"}
             
-            # Format as conversation for chat model
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            
             payload = {
                 "inputs": self._format_for_llama2(system_prompt, user_prompt),
                 "parameters": {
@@ -150,7 +235,8 @@ Please respond warmly and supportively to the user's message. Remember to stay w
                 }
             }
             
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=10)
+            async with self._llm_slots:
+                response = await self.client.post(self.api_url, headers=headers, json=payload, timeout=10)
             
             if response.status_code == 200:
                 result = response.json()
@@ -169,7 +255,7 @@ Please respond warmly and supportively to the user's message. Remember to stay w
             logger.error(f"HuggingFace API request failed: {e}")
             return self._generate_fallback_response("", "NEGATIVE")
     
-    def _generate_with_ollama(self, system_prompt: str, user_prompt: str) -> str:
+    async def _generate_with_ollama(self, system_prompt: str, user_prompt: str) -> str:
         """
         Generate response using local Ollama instance
         
@@ -187,11 +273,12 @@ Please respond warmly and supportively to the user's message. Remember to stay w
                 "temperature": 0.7,
             }
             
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json=payload,
-                timeout=30
-            )
+            async with self._llm_slots:
+                response = await self.client.post(
+                    f"{self.ollama_url}/api/generate",
+                    json=payload,
+                    timeout=30
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -202,7 +289,7 @@ Please respond warmly and supportively to the user's message. Remember to stay w
                 logger.error(f"Ollama API error: {response.status_code}")
                 return self._generate_fallback_response("", "NEGATIVE")
         
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
             logger.error(f"Cannot connect to Ollama at {self.ollama_url}")
             return self._generate_fallback_response("", "NEGATIVE")
         
@@ -210,6 +297,67 @@ Please respond warmly and supportively to the user's message. Remember to stay w
             logger.error(f"Ollama request failed: {e}")
             return self._generate_fallback_response("", "NEGATIVE")
     
+    async def _stream_with_huggingface(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """
+        Stream tokens from HuggingFace Inference API
+        With "stream": true the API sends server-sent events, one token per event
+        """
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        payload = {
+            "inputs": self._format_for_llama2(system_prompt, user_prompt),
+            "parameters": {
+                "max_new_tokens": 150,
+                "temperature": 0.7,
+                "top_p": 0.9,
+            },
+            "stream": True
+        }
+        
+        async with self._llm_slots, self.client.stream(
+            "POST", self.api_url, headers=headers, json=payload, timeout=10
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                logger.error(f"HuggingFace API error: {response.status_code} - {body.decode(errors='replace')}")
+                return
+            
+            async for line in response.aiter_lines():
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):])
+                token = event.get("token", {})
+                if not token.get("special"):
+                    yield token.get("text", "")
+    
+    async def _stream_with_ollama(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """
+        Stream tokens from local Ollama instance
+        Ollama streams newline-delimited JSON objects, each with a "response" fragment
+        """
+        full_prompt = f"{system_prompt}\n\nUser: {user_prompt}\n\nAssistant:"
+        
+        payload = {
+            "model": self.model_name,
+            "prompt": full_prompt,
+            "stream": True,
+            "temperature": 0.7,
+        }
+        
+        async with self._llm_slots, self.client.stream(
+            "POST", f"{self.ollama_url}/api/generate", json=payload, timeout=30
+        ) as response:
+            if response.status_code != 200:
+                logger.error(f"Ollama API error: {response.status_code}")
+                return
+            
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                yield chunk.get("response", "")
+                if chunk.get("done"):
+                    break
+    
     def _generate_fallback_response(self, user_message: str, sentiment: str) -> str:
         """
         Generate a template-based response when LLM is unavailable
@@ -217,25 +365,7 @@ Please respond warmly and supportively to the user's message. Remember to stay w
         This ensures the chatbot always has a meaningful response
         even without API access or local model
         """
-        fallback_responses = {
-            "NEGATIVE": [
-                "I hear that you're going through a difficult time. It's okay to feel this way, and I'm here to listen. What's been the most challenging part for you?",
-                "Thank you for sharing that with me. Those feelings are valid, and many people experience what you're going through. Have you tried any coping strategies that have helped before?",
-                "I can sense you're struggling right now. That takes courage to express. Remember that difficult feelings are temporary, even when they feel overwhelming.",
-                "It sounds like you're dealing with a lot. While I can't provide medical advice, I encourage you to consider talking with a counselor or therapist who can offer professional support.",
-                "I appreciate you opening up about this. Sometimes just acknowledging what we're feeling is an important first step. What would help you feel a little better right now?"
-            ],
-            "POSITIVE": [
-                "That sounds wonderful! It's great to hear positive energy from you. What's been contributing to this good feeling?",
-                "I'm glad to hear that! Celebrating these moments is important. How are you planning to maintain this positive momentum?",
-                "That's fantastic! Keep nurturing what's bringing you joy. What's one thing you appreciate about yourself right now?",
-                "Your positive outlook is inspiring! Keep channeling that energy into things that matter to you.",
-                "That's excellent! It sounds like things are moving in a good direction for you. What's helping you feel this way?"
-            ]
-        }
-        
-        import random
-        responses = fallback_responses.get(sentiment, fallback_responses["POSITIVE"])
+        responses = FALLBACK_RESPONSES.get(sentiment, FALLBACK_RESPONSES["POSITIVE"])
         return random.choice(responses)
     
     def _format_for_llama2(self, system_prompt: str, user_prompt: str) -> str:
@@ -243,9 +373,7 @@ Please respond warmly and supportively to the user's message. Remember to stay w
         Format prompts for Llama-2-chat model
         Llama-2 expects specific formatting for chat
         """
-        return f"""[INST] <<SYS>>
-{system_prompt}
-<</SYS>>
-
-{user_prompt}
-[/INST]"""
+        prefix = LLAMA2_PROMPT_PREFIXES.get(system_prompt)
+        if prefix is None:
+            prefix = f"[INST] <<SYS>>\n{system_prompt}\n<</SYS>>\n\n"
+        return f"{prefix}{user_prompt}\n[/INST]"
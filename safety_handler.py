@@ -1,12 +1,91 @@
 # Safety Handler Module
 # Detects high-risk language and provides crisis response
 
+import functools
 import logging
-import re
-from typing import Dict, List
+import os
+import ahocorasick
+from types import MappingProxyType
+from typing import Iterator, List, Mapping, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Number of distinct messages whose risk assessment is memoized
+RISK_CACHE_SIZE = int(os.getenv("RISK_CACHE_SIZE", "1024"))
+
+# Keyword tiers; medium-risk keywords only count when no high-risk keyword is found
+HIGH_TIER = 0
+MEDIUM_TIER = 1
+
+# (is_high_risk, risk_level, risk_indicators) for a message with no keywords
+LOW_RISK_RESULT = (False, "low", ())
+
+# Shared read-only assessment returned for that case, which is most chat messages,
+# so the common path allocates nothing. Callers only read assessments
+LOW_RISK_ASSESSMENT = MappingProxyType({
+    "is_high_risk": False,
+    "risk_level": "low",
+    "risk_indicators": ()
+})
+
+# High-risk categories that on their own make a message high risk
+CRISIS_CATEGORIES = ("suicide", "self_harm")
+
+# Latin-1 word characters (same class as regex \w: letters, digits, underscore),
+# precomputed so the boundary check on each keyword hit is one set lookup.
+# Characters past U+00FF are rare in messages and fall back to str.isalnum()
+_WORD_CHARS = frozenset(chr(i) for i in range(256) if chr(i).isalnum() or chr(i) == "_")
+
+# Fixed reply for high-risk messages, with professional resources
+CRISIS_RESPONSE = """I'm concerned about what you're sharing. Your safety is important.
+
+If you're in immediate danger or having thoughts of self-harm, please reach out to emergency services or a crisis helpline right away:
+
+🆘 **Immediate Help Resources:**
+• **National Suicide Prevention Lifeline (US):** 988 (call or text)
+• **Crisis Text Line:** Text HOME to 741741
+• **International Association for Suicide Prevention:** https://www.iasp.info/resources/Crisis_Centres/
+• **Samaritans (UK):** 116 123
+• **Lifeline (Australia):** 13 11 14
+• **India Crisis Helpline:** 9152987821
+
+Please reach out to someone you trust - a friend, family member, or mental health professional. You're not alone in this.
+
+This chatbot is not a substitute for professional mental health care. Please speak with a licensed therapist or counselor."""
+
+# Suggested next steps per risk level
+RESOURCE_SUGGESTIONS = {
+    "low": (
+        "Consider journaling about your feelings",
+        "Try a breathing exercise when stressed",
+        "Reach out to someone you trust",
+        "Engage in activities that bring joy",
+    ),
+    "medium": (
+        "Consider speaking with a counselor or therapist",
+        "Contact a crisis support hotline",
+        "Visit a mental health clinic",
+        "Reach out to a trusted friend or family member",
+    ),
+    "high": (
+        "**Contact emergency services immediately**",
+        "**Call the National Suicide Prevention Lifeline: 988**",
+        "**Go to the nearest emergency room**",
+        "**Tell someone you trust right now**",
+    )
+}
+
+def _to_assessment(result: Tuple[bool, str, Tuple[str, ...]]) -> Mapping:
+    """Public assessment for a (is_high_risk, risk_level, risk_indicators) result"""
+    if result is LOW_RISK_RESULT:
+        return LOW_RISK_ASSESSMENT
+    is_high_risk, risk_level, risk_indicators = result
+    return {
+        "is_high_risk": is_high_risk,
+        "risk_level": risk_level,
+        "risk_indicators": list(risk_indicators)
+    }
+
 class SafetyHandler:
     """
     Detects high-risk indicators in user messages
@@ -14,32 +93,59 @@ class SafetyHandler:
     Provides appropriate crisis response and resources
     """
     
+    # HIGH-RISK keywords indicating immediate danger
+    HIGH_RISK_KEYWORDS = {
+        "suicide": ("suicide", "suicidal", "kill myself", "end my life", "don't want to live"),
+        "self_harm": ("self harm", "cut myself", "hurt myself", "injure", "harm myself"),
+        "extreme_despair": ("can't take it anymore", "hopeless", "no point", "nothing matters"),
+        "abuse": ("abusing me", "beat me", "hit me", "abuse", "violent"),
+        "acute_crisis": ("emergency", "urgent", "right now", "immediately")
+    }
+    
+    # MEDIUM-RISK keywords indicating elevated emotional distress
+    MEDIUM_RISK_KEYWORDS = (
+        "depressed", "suicidal thoughts", "panic", "overwhelmed",
+        "can't cope", "breakdown", "crisis", "scared", "terrified",
+        "dying", "death", "toxic", "trapped"
+    )
+    
     def __init__(self):
         """Initialize safety detection patterns"""
         
-        # HIGH-RISK keywords indicating immediate danger
-        self.high_risk_keywords = {
-            "suicide": ["suicide", "suicidal", "kill myself", "end my life", "don't want to live"],
-            "self_harm": ["self harm", "cut myself", "hurt myself", "injure", "harm myself"],
-            "extreme_despair": ["can't take it anymore", "hopeless", "no point", "nothing matters"],
-            "abuse": ["abusing me", "beat me", "hit me", "abuse", "violent"],
-            "acute_crisis": ["emergency", "urgent", "right now", "immediately"]
-        }
-        
-        # MEDIUM-RISK keywords indicating elevated emotional distress
-        self.medium_risk_keywords = [
-            "depressed", "suicidal thoughts", "panic", "overwhelmed",
-            "can't cope", "breakdown", "crisis", "scared", "terrified",
-            "dying", "death", "toxic", "trapped"
-        ]
-        
-        # Low-risk everyday emotional words
-        self.low_risk_keywords = [
-            "sad", "anxious", "worried", "stressed", "frustrated",
-            "tired", "lonely", "confused", "lost", "scared"
-        ]
+        # Results memoized per lowercased message: retries, repeated greetings and
+        # re-checks of the same message skip the scan (lru_cache is thread-safe)
+        self._classify_cached = functools.lru_cache(maxsize=RISK_CACHE_SIZE)(self._classify)
+        
+        # Flat parallel tables over every scanned keyword; scanners report a keyword
+        # by its index, and everything needed per hit is one tuple index away
+        # A keyword listed more than once belongs only to the first (highest) tier
+        # it appears in, so every keyword is scanned once and categorized one way
+        entries = []
+        seen = set()
+        tiered_keywords = [
+            (keyword, category, HIGH_TIER)
+            for category, keywords in self.HIGH_RISK_KEYWORDS.items()
+            for keyword in keywords
+        ] + [(keyword, "medium_risk", MEDIUM_TIER) for keyword in self.MEDIUM_RISK_KEYWORDS]
+        for keyword, category, tier in tiered_keywords:
+            if keyword not in seen:
+                seen.add(keyword)
+                entries.append((keyword, category, tier))
+        self._kw_strings = tuple(keyword for keyword, _, _ in entries)
+        self._kw_categories = tuple(category for _, category, _ in entries)
+        self._kw_tiers = tuple(tier for _, _, tier in entries)
+        self._kw_lengths = tuple(len(keyword) for keyword in self._kw_strings)
+        self._kw_indicators = tuple(f"{category}: {keyword}" for keyword, category, _ in entries)
+        self._min_keyword_length = min(self._kw_lengths)
+        
+        # Aho-Corasick automaton over all high/medium keywords
+        # Finds every candidate keyword in a single pass over the message
+        self._automaton = ahocorasick.Automaton()
+        for i, keyword in enumerate(self._kw_strings):
+            self._automaton.add_word(keyword, i)
+        self._automaton.make_automaton()
     
-    def assess_risk(self, message: str) -> Dict:
+    def assess_risk(self, message: str) -> Mapping:
         """
         Assess risk level of user message
         
@@ -47,70 +153,123 @@ class SafetyHandler:
             message: User message to analyze
         
         Returns:
-            Dict with 'is_high_risk', 'risk_level', and 'risk_indicators'
+            Mapping with 'is_high_risk', 'risk_level', and 'risk_indicators'
+            (the shared read-only LOW_RISK_ASSESSMENT when nothing was found)
         """
         try:
-            message_lower = message.lower()
-            risk_indicators = []
-            
-            # Check for high-risk patterns
-            for category, keywords in self.high_risk_keywords.items():
-                for keyword in keywords:
-                    if self._keyword_match(message_lower, keyword):
-                        risk_indicators.append(f"{category}: {keyword}")
-            
-            # Check for medium-risk keywords
-            if not risk_indicators:  # Only check if no high-risk found
-                for keyword in self.medium_risk_keywords:
-                    if self._keyword_match(message_lower, keyword):
-                        risk_indicators.append(f"medium_risk: {keyword}")
-            
-            # Determine risk level
-            if risk_indicators and any("suicide" in ind or "self_harm" in ind for ind in risk_indicators):
-                risk_level = "high"
-                is_high_risk = True
-            elif len([ind for ind in risk_indicators if "medium_risk" in ind]) >= 2:
-                risk_level = "medium"
-                is_high_risk = False
-            else:
-                risk_level = "low"
-                is_high_risk = False
-            
-            logger.info(f"Risk assessment: {risk_level} | Indicators: {risk_indicators}")
-            
-            return {
-                "is_high_risk": is_high_risk,
-                "risk_level": risk_level,
-                "risk_indicators": risk_indicators[:5]  # Limit to top 5
-            }
+            result = self._assess(message)
+            logger.info("Risk assessment: %s | Indicators: %s", result[1], result[2])
+            return _to_assessment(result)
         
         except Exception as e:
             logger.error(f"Error in risk assessment: {e}")
-            return {
-                "is_high_risk": False,
-                "risk_level": "low",
-                "risk_indicators": []
-            }
+            return LOW_RISK_ASSESSMENT
     
-    def _keyword_match(self, message: str, keyword: str) -> bool:
+    def assess_risk_batch(self, messages: List[str]) -> List[Mapping]:
         """
-        Safely match keyword in message
-        Uses word boundaries to avoid false positives
+        Assess risk level of several messages in one call
+        For backfills, moderation queues and session replays; repeated messages
+        in the batch are scanned once, and a failure only affects its own message
         
         Args:
-            message: Message to search in (lowercase)
-            keyword: Keyword to find
+            messages: User messages to analyze
         
         Returns:
-            True if keyword found with word boundaries
+            List of dicts like assess_risk returns, in the same order as messages
         """
-        try:
-            # Use regex with word boundaries for accurate matching
-            pattern = r'\b' + re.escape(keyword) + r'\b'
-            return bool(re.search(pattern, message))
-        except:
-            # Fallback to simple string matching if regex fails
-            return keyword in message
+        results = []
+        high_risk_count = 0
+        for message in messages:
+            try:
+                result = self._assess(message)
+            except Exception as e:
+                logger.error(f"Error in risk assessment: {e}")
+                result = LOW_RISK_RESULT
+            high_risk_count += result[0]
+            results.append(_to_assessment(result))
+        
+        logger.info("Risk assessment batch: %d messages | %d high risk", len(results), high_risk_count)
+        return results
+    
+    def _assess(self, message: str) -> Tuple[bool, str, Tuple[str, ...]]:
+        """
+        Lowercase, precheck and classify one message through the LRU cache
+        
+        Returns:
+            (is_high_risk, risk_level, top 5 risk indicators)
+        """
+        message_lower = message.lower()
+        # Too short to contain any keyword, or no letters at all ("ok", emoji, "..."):
+        # nothing can match, so skip the scan and keep these out of the cache
+        if len(message_lower) < self._min_keyword_length or not any(char.isalpha() for char in message_lower):
+            return LOW_RISK_RESULT
+        return self._classify_cached(message_lower)
+    
+    def _classify(self, message_lower: str) -> Tuple[bool, str, Tuple[str, ...]]:
+        """
+        Scan a lowercased message and decide its risk level
+        Returns an immutable result so it can be memoized (see _classify_cached)
+        
+        Returns:
+            (is_high_risk, risk_level, top 5 risk indicators)
+        """
+        # Indicators are capped at the top 5 as they are found, and the level is
+        # decided from the crisis flag and list sizes, with no second pass over them
+        high_indicators = []
+        medium_indicators = []
+        crisis_hit = False
+        
+        for i in self._scan(message_lower):
+            indicators = high_indicators if self._kw_tiers[i] == HIGH_TIER else medium_indicators
+            indicator = self._kw_indicators[i]
+            if len(indicators) < 5 and indicator not in indicators:
+                indicators.append(indicator)
+            # A single suicide/self-harm hit already makes the message high risk,
+            # so the rest of the message doesn't need scanning. It is listed first
+            # (even if five other indicators came before it) so the result and the
+            # warning log always show what escalated the message
+            if self._kw_categories[i] in CRISIS_CATEGORIES:
+                crisis_hit = True
+                if indicator in high_indicators:
+                    high_indicators.remove(indicator)
+                high_indicators = [indicator] + high_indicators[:4]
+                break
+        
+        # Determine risk level; medium-risk keywords only count if no high-risk found
+        if crisis_hit:
+            return True, "high", tuple(high_indicators)
+        if high_indicators:
+            return False, "low", tuple(high_indicators)
+        if len(medium_indicators) >= 2:
+            return False, "medium", tuple(medium_indicators)
+        if medium_indicators:
+            return False, "low", tuple(medium_indicators)
+        return LOW_RISK_RESULT
+    
+    def _scan(self, message_lower: str) -> Iterator[int]:
+        """
+        Find all keywords in the message, respecting word boundaries
+        
+        Args:
+            message_lower: Lowercased message
+        
+        Yields:
+            Keyword index (into the _kw_* tables) for every keyword occurrence
+        """
+        # Single scan for all keywords; each hit is kept only if it is a whole word,
+        # i.e. the characters either side are not word characters (same as regex \b)
+        last = len(message_lower) - 1
+        for end, i in self._automaton.iter(message_lower):
+            start = end - self._kw_lengths[i] + 1
+            if start > 0:
+                before = message_lower[start - 1]
+                if before in _WORD_CHARS or (before > "\xff" and before.isalnum()):
+                    continue
+            if end < last:
+                after = message_lower[end + 1]
+                if after in _WORD_CHARS or (after > "\xff" and after.isalnum()):
+                    continue
+            yield i
     
     def get_crisis_response(self) -> str:
         """
@@ -119,36 +278,22 @@ class SafetyHandler:
         Returns:
             Crisis response message with emergency resources
         """
-        crisis_response = """I'm concerned about what you're sharing. Your safety is important.
-
-If you're in immediate danger or having thoughts of self-harm, please reach out to emergency services or a crisis helpline right away:
-
-🆘 **Immediate Help Resources:**
-• **National Suicide Prevention Lifeline (US):** 988 (call or text)
-• **Crisis Text Line:** Text HOME to 741741
-• **International Association for Suicide Prevention:** https://www.iasp.info/resources/Crisis_Centres/
-• **Samaritans (UK):** 116 123
-• **Lifeline (Australia):** 13 11 14
-• **India Crisis Helpline:** 9152987821
-
-Please reach out to someone you trust - a friend, family member, or mental health professional. You're not alone in this.
-
-This chatbot is not a substitute for professional mental health care. Please speak with a licensed therapist or counselor."""
-        
-        return crisis_response
+        return CRISIS_RESPONSE
     
-    def is_safe_to_continue(self, message: str) -> bool:
+    def is_safe_to_continue(self, message: str, assessment: Optional[Mapping] = None) -> bool:
         """
         Check if conversation can continue safely
         Used to determine if bot should refuse to engage
         
         Args:
             message: Message to check
+            assessment: Result of assess_risk(message) if the caller already has it
         
         Returns:
             True if safe to continue, False if immediate danger detected
         """
-        assessment = self.assess_risk(message)
+        if assessment is None:
+            assessment = self.assess_risk(message)
         # Only refuse if explicitly high-risk (suicide/self-harm indicators)
         return not assessment['is_high_risk']
     
@@ -162,25 +307,4 @@ This chatbot is not a substitute for professional mental health care. Please spe
         Returns:
             List of relevant resource suggestions
         """
-        resources = {
-            "low": [
-                "Consider journaling about your feelings",
-                "Try a breathing exercise when stressed",
-                "Reach out to someone you trust",
-                "Engage in activities that bring joy"
-            ],
-            "medium": [
-                "Consider speaking with a counselor or therapist",
-                "Contact a crisis support hotline",
-                "Visit a mental health clinic",
-                "Reach out to a trusted friend or family member"
-            ],
-            "high": [
-                "**Contact emergency services immediately**",
-                "**Call the National Suicide Prevention Lifeline: 988**",
-                "**Go to the nearest emergency room**",
-                "**Tell someone you trust right now**"
-            ]
-        }
-        
-        return resources.get(risk_level, resources["low"])
+        return list(RESOURCE_SUGGESTIONS.get(risk_level, RESOURCE_SUGGESTIONS["low"]))
@@ -0,0 +1,127 @@
+# Safety Handler Tests
+# Pins down crisis detection so changes to the keyword scan can be checked
+# Run with: python -m unittest test_safety_handler
+
+import random
+import re
+import unittest
+
+from safety_handler import CRISIS_CATEGORIES, LOW_RISK_ASSESSMENT, SafetyHandler
+
+# (message, risk_level, is_high_risk, risk_indicators in reported order)
+EXPECTED_ASSESSMENTS = [
+    ("", "low", False, []),
+    ("ok", "low", False, []),
+    ("😀😀", "low", False, []),
+    ("I had a nice day at the park", "low", False, []),
+    ("I want to KILL MYSELF", "high", True, ["suicide: kill myself"]),
+    ("Suicide.", "high", True, ["suicide: suicide"]),
+    ("I keep thinking I should hurt myself", "high", True, ["self_harm: hurt myself"]),
+    ("self harm myself", "high", True, ["self_harm: self harm"]),
+    # Word boundaries: keywords inside longer words don't count
+    ("I ran suicidally fast, it was harmless", "low", False, []),
+    ("the antisuicide campaign was nonviolent", "low", False, []),
+    ("self-harm", "low", False, []),
+    # High-tier keywords outside suicide/self-harm are reported but stay low risk
+    ("This is urgent, I feel hopeless", "low", False, ["acute_crisis: urgent", "extreme_despair: hopeless"]),
+    # Medium keywords only raise the level when two or more are found
+    ("i'm so depressed", "low", False, ["medium_risk: depressed"]),
+    (
+        "i'm so depressed, overwhelmed and scared",
+        "medium",
+        False,
+        ["medium_risk: depressed", "medium_risk: overwhelmed", "medium_risk: scared"]
+    ),
+    # Medium keywords are ignored once a high-tier keyword is found
+    ("I'm depressed and scared, it's urgent", "low", False, ["acute_crisis: urgent"]),
+    # The crisis keyword is listed first even when five others come before it
+    (
+        "This is urgent, an emergency, I need help right now, immediately. "
+        "I feel hopeless and I want to end my life",
+        "high",
+        True,
+        [
+            "suicide: end my life",
+            "acute_crisis: urgent",
+            "acute_crisis: emergency",
+            "acute_crisis: right now",
+            "acute_crisis: immediately"
+        ]
+    ),
+]
+
+def _reference_assessment(message):
+    """
+    Original per-keyword implementation of assess_risk, kept as the reference
+    the optimized scan must agree with on risk level
+    
+    Returns:
+        (is_high_risk, risk_level, all risk indicators found)
+    """
+    message_lower = message.lower()
+    risk_indicators = []
+    for category, keywords in SafetyHandler.HIGH_RISK_KEYWORDS.items():
+        for keyword in keywords:
+            if re.search(r'\b' + re.escape(keyword) + r'\b', message_lower):
+                risk_indicators.append(f"{category}: {keyword}")
+    if not risk_indicators:
+        for keyword in SafetyHandler.MEDIUM_RISK_KEYWORDS:
+            if re.search(r'\b' + re.escape(keyword) + r'\b', message_lower):
+                risk_indicators.append(f"medium_risk: {keyword}")
+    
+    if any("suicide" in ind or "self_harm" in ind for ind in risk_indicators):
+        return True, "high", risk_indicators
+    if len([ind for ind in risk_indicators if "medium_risk" in ind]) >= 2:
+        return False, "medium", risk_indicators
+    return False, "low", risk_indicators
+
+class SafetyHandlerTest(unittest.TestCase):
+    """Expected assessments for known messages, and agreement with the reference"""
+    
+    def setUp(self):
+        self.handler = SafetyHandler()
+    
+    def test_expected_assessments(self):
+        for message, risk_level, is_high_risk, risk_indicators in EXPECTED_ASSESSMENTS:
+            with self.subTest(message=message):
+                assessment = self.handler.assess_risk(message)
+                self.assertEqual(assessment["risk_level"], risk_level)
+                self.assertEqual(assessment["is_high_risk"], is_high_risk)
+                self.assertEqual(list(assessment["risk_indicators"]), risk_indicators)
+    
+    def test_no_indicators_returns_shared_assessment(self):
+        self.assertIs(self.handler.assess_risk("hello there"), LOW_RISK_ASSESSMENT)
+        self.assertIs(self.handler.assess_risk("ok"), LOW_RISK_ASSESSMENT)
+    
+    def test_batch_matches_single_assessments(self):
+        messages = [message for message, _, _, _ in EXPECTED_ASSESSMENTS]
+        batch = self.handler.assess_risk_batch(messages)
+        self.assertEqual([dict(a) for a in batch], [dict(self.handler.assess_risk(m)) for m in messages])
+    
+    def test_matches_reference_on_generated_messages(self):
+        keywords = [
+            keyword for keywords in SafetyHandler.HIGH_RISK_KEYWORDS.values() for keyword in keywords
+        ] + list(SafetyHandler.MEDIUM_RISK_KEYWORDS)
+        filler = [
+            "i", "feel", "the", "today", "suicidally", "antisuicide", "harmless", "scaredy",
+            "KILL", "Myself", "don't", "ok", "!", "...", "é", "death's"
+        ]
+        rng = random.Random(1)
+        for _ in range(5000):
+            message = " ".join(rng.choice(keywords + filler * 3) for _ in range(rng.randint(0, 12)))
+            is_high_risk, risk_level, risk_indicators = _reference_assessment(message)
+            assessment = self.handler.assess_risk(message)
+            with self.subTest(message=message):
+                self.assertEqual(assessment["risk_level"], risk_level)
+                self.assertEqual(assessment["is_high_risk"], is_high_risk)
+                indicators = list(assessment["risk_indicators"])
+                self.assertLessEqual(len(indicators), 5)
+                self.assertTrue(set(indicators) <= set(risk_indicators))
+                if is_high_risk:
+                    # The scan stops at the deciding hit, which is always listed first
+                    self.assertIn(indicators[0].split(":")[0], CRISIS_CATEGORIES)
+                elif len(risk_indicators) <= 5:
+                    self.assertEqual(set(indicators), set(risk_indicators))
+
+if __name__ == "__main__":
+    unittest.main()